@@ -0,0 +1,381 @@
+"""
+Headless batch processing: ROI export + color detection over a directory tree.
+
+    python batch.py recorded_sessions --rois rois.json --params detect_params.json
+
+- rois.json / detect_params.json are the files exported from roi.html / detect.html.
+- Without --rois, color detection runs on each whole video (e.g. already cropped ROI videos).
+- Files are identified by content hash (sha256). A file already processed with the
+  same ROIs + params is skipped, so an interrupted run can simply be restarted.
+- Derived folders (roi_videos/, split_videos/) and the output folder are not searched.
+- Results go to <out>/<hash>_<settings>/, plus <out>/batch_manifest.json (resume
+  state) and <out>/batch_summary.csv (one row per video found / ROI, for the
+  settings of this run; copies of the same content share one set of results).
+"""
+import os
+import sys
+import csv
+import json
+import signal
+import hashlib
+import argparse
+import traceback
+from pathlib import Path
+from datetime import datetime
+from multiprocessing.managers import SyncManager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from processing import (ALLOWED_EXTENSIONS, UPLOAD_DIR, RESULT_DIR, has_ffmpeg,
+                        run_roi_export, run_color_detect)
+
+MANIFEST_NAME = "batch_manifest.json"
+SUMMARY_NAME = "batch_summary.csv"
+# derived outputs (ROI crops, /cut-video clips) that must not be picked up again as inputs
+SKIP_DIRS = {"roi_videos", "split_videos"}
+HASH_CHUNK = 8 * 1024 * 1024
+# ProcessPoolExecutor refuses more workers than this on Windows
+WINDOWS_MAX_WORKERS = 61
+# roi_name used when detecting on whole videos (no --rois)
+FULL_FRAME = "full_frame"
+
+# -----------------------
+# Helpers
+# -----------------------
+def discover_videos(root: Path, out_dir: Path):
+    out_dir = out_dir.resolve()
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirpath = Path(dirpath).resolve()
+        # prune derived/output folders in place so os.walk skips them
+        dirnames[:] = [d for d in dirnames
+                       if d not in SKIP_DIRS and (dirpath / d) != out_dir]
+        for name in filenames:
+            if Path(name).suffix.lower() in ALLOWED_EXTENSIONS:
+                found.append(dirpath / name)
+    return sorted(found)
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def settings_key(settings: dict) -> str:
+    blob = json.dumps(settings, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+def load_manifest(path: Path):
+    """
+    {"files": {sha: {settings_key: record}},   # one record per content + settings
+     "settings": {settings_key: settings},
+     "paths": {path: {"size", "mtime", "sha256"}}}  # hash cache
+    """
+    if path.exists():
+        try:
+            data = json.loads(path.read_text())
+            data.setdefault("files", {})
+            data.setdefault("settings", {})
+            data.setdefault("paths", {})
+            # earlier layout kept one record per hash; those files are simply redone
+            data["files"] = {sha: recs for sha, recs in data["files"].items()
+                             if "status" not in recs}
+            return data
+        except Exception:
+            print(f"Warning: unreadable manifest {path}, starting fresh", file=sys.stderr)
+    return {"files": {}, "settings": {}, "paths": {}}
+
+def save_manifest(path: Path, manifest: dict):
+    # write-then-rename so an interrupted run never leaves a truncated manifest
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, path)
+
+def write_summary(path: Path, manifest: dict, skey: str, hashes: dict, unreadable: dict):
+    """One row per video found in this run (x ROI), with its results for settings skey."""
+    with open(path, "w", newline="") as fcsv:
+        w = csv.writer(fcsv)
+        w.writerow(["source", "sha256", "settings", "status", "roi_name", "frames",
+                    "detections", "detections_csv", "finished_at", "error"])
+        rows = []
+        for source, sha in hashes.items():
+            rec = manifest["files"].get(sha, {}).get(skey) or {"status": "pending"}
+            common = [source, sha, skey, rec["status"]]
+            results = rec.get("results") or []
+            if not results:
+                rows.append(common + ["", "", "", "", rec.get("finished_at", ""), rec.get("error", "")])
+            for r in results:
+                rows.append(common + [r["roi_name"], r["frames"], r["detections"],
+                                      r["csv"], rec.get("finished_at", ""), ""])
+        for source, err in unreadable.items():
+            rows.append([source, "", skey, "unreadable", "", "", "", "", "", err])
+        w.writerows(sorted(rows, key=lambda row: row[0]))
+
+# -----------------------
+# Worker side
+# -----------------------
+def ignore_sigint():
+    # Ctrl-C is handled by the driver, which cancels the pending work
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def init_worker():
+    ignore_sigint()
+    # one video per process; keep OpenCV from oversubscribing the cores
+    cv2.setNumThreads(1)
+
+def hash_task(path: str):
+    try:
+        st = os.stat(path)
+        return path, st.st_size, st.st_mtime, file_sha256(path), None
+    except OSError as e:
+        return path, None, None, None, str(e)
+
+def process_task(src: str, sha: str, out_root: str, settings: dict, skey: str,
+                 threads: int, started):
+    # lets the driver tell which videos were running if this worker dies
+    started[sha] = os.getpid()
+    # named by content + settings, so copies of a file share one result folder
+    # and a rerun with other ROIs/params never mixes outputs
+    job_dir = Path(out_root) / f"{sha[:12]}_{skey[:8]}"
+    job_dir.mkdir(parents=True, exist_ok=True)
+    params = settings["params"]
+    try:
+        if settings["rois"]:
+            roi_dir = job_dir / "roi_videos"
+            roi_videos = run_roi_export(src_path=src, rois=settings["rois"],
+                                        out_dir=str(roi_dir), base_name=sha[:12],
+                                        margin=settings["margin"], threads=threads)
+            # <roi_videos>/<label>/<hash>.mp4 -> roi name "<label>"
+            targets = [(v, Path(v).parent.name) for v in roi_videos]
+        else:
+            targets = [(src, FULL_FRAME)]
+
+        results = []
+        for vid, base in targets:
+            res = run_color_detect(src_path=vid, out_dir=str(job_dir), base=base,
+                                   v_low=params["v_low"], v_high=params["v_high"],
+                                   min_frac=params["min_frac"], threads=threads)
+            results.append({"roi_name": base, "frames": res["frames"],
+                            "detections": res["detections"], "csv": res["csv"]})
+        return {"status": "ok", "results": results}
+    except Exception as e:
+        traceback.print_exc()
+        return {"status": "error", "error": str(e) or type(e).__name__}
+
+# -----------------------
+# Driver
+# -----------------------
+def stop_pool(pool: ProcessPoolExecutor):
+    """Cancel queued work and kill the running workers instead of waiting for them."""
+    # _processes is private to ProcessPoolExecutor; if it ever goes away we fall back
+    # to waiting for the running videos to finish
+    procs = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for proc in procs:
+        proc.terminate()
+
+def run_pool(shas, pending, workers, task_args, started, on_done):
+    """
+    Run process_task for shas in a fresh pool, calling on_done(sha, record) as each finishes.
+    If a worker dies the pool is broken and every unfinished future fails with it; returns
+    (running, rest): unfinished shas that had started (one of them killed the worker)
+    and the ones still queued.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    try:
+        futures = {pool.submit(process_task, pending[sha], sha, *task_args, started): sha
+                   for sha in shas}
+        unfinished = []
+        for fut in as_completed(futures):
+            sha = futures[fut]
+            try:
+                rec = fut.result()
+            except BrokenProcessPool:
+                unfinished.append(sha)
+                continue
+            on_done(sha, rec)
+    except KeyboardInterrupt:
+        stop_pool(pool)
+        raise
+    finally:
+        pool.shutdown(wait=True)
+    running = [sha for sha in unfinished if sha in started]
+    return running, [sha for sha in unfinished if sha not in started]
+
+def process_all(pending, workers, task_args, on_done):
+    """
+    Process every sha in pending ({sha: path}). A crashed worker (segfault, OOM kill)
+    only costs a new pool: queued videos are resubmitted, and the ones that were running
+    are retried one at a time at the end, where a second crash is recorded as an error.
+    """
+    mgr = SyncManager()
+    mgr.start(ignore_sigint)
+    try:
+        started = mgr.dict()
+        todo, suspects = list(pending), []
+        while todo:
+            running, todo = run_pool(todo, pending, workers, task_args, started, on_done)
+            if todo and not running:
+                # crashed before any video started; don't loop, isolate them all
+                suspects += todo
+                break
+            if running:
+                print(f"Worker crashed; retrying {len(running)} video(s) one at a time later",
+                      file=sys.stderr)
+            suspects += running
+        for sha in suspects:
+            started.pop(sha, None)
+            running, rest = run_pool([sha], pending, 1, task_args, started, on_done)
+            if running or rest:
+                on_done(sha, {"status": "error", "error": "worker process crashed twice"})
+    finally:
+        mgr.shutdown()
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Batch ROI export + color detection over a directory tree.")
+    ap.add_argument("input_dir", nargs="?", default=str(UPLOAD_DIR),
+                    help="directory searched recursively for videos (default: recorded_sessions)")
+    ap.add_argument("--out", default=str(RESULT_DIR / "batch"),
+                    help="output directory (default: detection_results/batch)")
+    ap.add_argument("--rois", help="ROI JSON exported from roi.html; omit to detect on whole videos")
+    ap.add_argument("--margin", type=int, default=0, help="pixels added around each ROI bounding box")
+    ap.add_argument("--params", help="detect_params.json exported from detect.html")
+    ap.add_argument("--v-low", type=int, help="override v_low")
+    ap.add_argument("--v-high", type=int, help="override v_high")
+    ap.add_argument("--min-frac", type=float, help="override min_frac")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="parallel processes (default: all cores)")
+    ap.add_argument("--force", action="store_true", help="reprocess files even if already done")
+    return ap.parse_args(argv)
+
+def build_settings(args):
+    params = {"v_low": 0, "v_high": 80, "min_frac": 0.05}
+    if args.params:
+        params.update(json.loads(Path(args.params).read_text()))
+    if args.v_low is not None:
+        params["v_low"] = args.v_low
+    if args.v_high is not None:
+        params["v_high"] = args.v_high
+    if args.min_frac is not None:
+        params["min_frac"] = args.min_frac
+    params = {"v_low": int(params["v_low"]), "v_high": int(params["v_high"]),
+              "min_frac": float(params["min_frac"])}
+
+    rois = []
+    if args.rois:
+        data = json.loads(Path(args.rois).read_text())
+        for i, r in enumerate(data.get("rois") or [], start=1):
+            # roi.html exports [x, y] pairs; accept {x, y} too like its importer
+            pts = [[p["x"], p["y"]] if isinstance(p, dict) else list(p) for p in r["points"]]
+            rois.append({"label": r.get("label") or f"roi{i}", "points": pts})
+        if not rois:
+            sys.exit(f"No ROIs found in {args.rois}")
+    return {"params": params, "rois": rois, "margin": args.margin if rois else 0}
+
+def main(argv=None):
+    args = parse_args(argv)
+    root = Path(args.input_dir)
+    if not root.is_dir():
+        sys.exit(f"Not a directory: {root}")
+    if not has_ffmpeg():
+        sys.exit("ffmpeg not found on PATH")
+
+    workers = max(1, args.workers)
+    if sys.platform == "win32":
+        workers = min(workers, WINDOWS_MAX_WORKERS)
+    # share the cores between the workers' ffmpeg encoders instead of each taking all of them
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    settings = build_settings(args)
+    skey = settings_key(settings)
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    manifest["settings"][skey] = settings
+
+    videos = discover_videos(root, out_dir)
+    print(f"Found {len(videos)} video(s) under {root}")
+
+    hashes, unreadable = {}, {}  # this run's path -> sha256 / error
+    n_err = 0
+    interrupted = False
+    try:
+        # 1) content hashes (cached by path/size/mtime so restarts don't re-read everything)
+        to_hash = []
+        for v in videos:
+            try:
+                st = v.stat()
+            except OSError as e:
+                print(f"Unreadable, skipped: {v} ({e})", file=sys.stderr)
+                unreadable[str(v)] = str(e)
+                continue
+            cached = manifest["paths"].get(str(v))
+            if cached and cached["size"] == st.st_size and cached["mtime"] == st.st_mtime:
+                hashes[str(v)] = cached["sha256"]
+            else:
+                to_hash.append(str(v))
+        if to_hash:
+            print(f"Hashing {len(to_hash)} file(s)...")
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+            try:
+                for fut in as_completed([pool.submit(hash_task, p) for p in to_hash]):
+                    path, size, mtime, sha, err = fut.result()
+                    if err:
+                        print(f"Unreadable, skipped: {path} ({err})", file=sys.stderr)
+                        unreadable[path] = err
+                        continue
+                    hashes[path] = sha
+                    manifest["paths"][path] = {"size": size, "mtime": mtime, "sha256": sha}
+            except KeyboardInterrupt:
+                stop_pool(pool)
+                raise
+            finally:
+                pool.shutdown(wait=True)
+            save_manifest(manifest_path, manifest)
+
+        # 2) one task per unique content not yet done with these settings
+        sources = {}
+        for path, sha in sorted(hashes.items()):
+            sources.setdefault(sha, []).append(path)
+        pending = {}
+        for sha, paths in sources.items():
+            if len(paths) > 1:
+                print(f"Duplicate content, processed once: {', '.join(paths)}")
+            rec = manifest["files"].get(sha, {}).get(skey)
+            if rec and rec.get("status") == "ok" and not args.force:
+                continue
+            pending[sha] = paths[0]
+        print(f"Skipping {len(sources) - len(pending)}, processing {len(pending)} "
+              f"with {workers} worker(s)")
+
+        n_done = 0
+        def on_done(sha, rec):
+            nonlocal n_done, n_err
+            n_done += 1
+            rec["finished_at"] = datetime.now().isoformat(timespec="seconds")
+            manifest["files"].setdefault(sha, {})[skey] = rec
+            save_manifest(manifest_path, manifest)
+            n_err += rec["status"] != "ok"
+            print(f"[{n_done}/{len(pending)}] {rec['status']:5s} {pending[sha]}"
+                  + (f" ({rec['error']})" if rec["status"] != "ok" else ""), flush=True)
+
+        process_all(pending, workers, (str(out_dir), settings, skey, threads), on_done)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("Interrupted: pending work cancelled.", file=sys.stderr)
+
+    save_manifest(manifest_path, manifest)
+    summary_path = out_dir / SUMMARY_NAME
+    write_summary(summary_path, manifest, skey, hashes, unreadable)
+    print(f"Summary: {summary_path}")
+    if interrupted:
+        print("Run again with the same arguments to resume.", file=sys.stderr)
+        return 130
+    return 1 if n_err or unreadable else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Video processing shared by server.py (Flask routes) and batch.py (headless CLI).
+Importing this module has no side effects: no app, no threads, no mkdir.
+"""
+import csv
+import cv2
+import subprocess
+import numpy as np
+from pathlib import Path
+
+# -----------------------
+# Config
+# -----------------------
+BASE_DIR = Path(__file__).resolve().parent
+UPLOAD_DIR = BASE_DIR / "recorded_sessions"
+RESULT_DIR = BASE_DIR / "detection_results"
+
+ALLOWED_EXTENSIONS = {'.webm', '.mp4', '.mkv', '.mov', '.avi', '.ogg'}
+
+# -----------------------
+# Helpers
+# -----------------------
+def is_ffmpeg_available():
+    try:
+        subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        return True
+    except Exception:
+        return False
+
+def has_ffmpeg():
+    return is_ffmpeg_available()
+
+def run_roi_export(src_path: str, rois: list, out_dir: str, base_name: str, margin: int = 0,
+                   threads: int = None):
+    """
+    Crop each polygon ROI out of src_path and encode it to
+    <out_dir>/<label>/<base_name>.mp4 (pixels outside the polygon are blacked out).
+    threads caps each ffmpeg encoder (default: ffmpeg picks, i.e. all cores).
+    Returns the list of written files; raises RuntimeError if an encode fails.
+    """
+    cap = cv2.VideoCapture(src_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video")
+
+    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps    = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    out_dir_path = Path(out_dir)
+    out_dir_path.mkdir(parents=True, exist_ok=True)
+
+    writers, roi_meta, outputs = [], [], []
+    for i, roi in enumerate(rois, start=1):
+        # sanitize label for filenames
+        label = (roi.get("label") or f"roi{i}").replace(" ", "_")
+        pts = np.array(roi["points"], dtype=np.float32)
+
+        # bounding box
+        x0 = max(0, int(np.floor(pts[:,0].min())) - margin)
+        y0 = max(0, int(np.floor(pts[:,1].min())) - margin)
+        x1 = min(width-1, int(np.ceil(pts[:,0].max())) + margin)
+        y1 = min(height-1, int(np.ceil(pts[:,1].max())) + margin)
+        w, h = max(1, x1-x0+1), max(1, y1-y0+1)
+
+        shifted = (pts - np.array([[x0, y0]], dtype=np.float32)).astype(np.int32).reshape((-1,1,2))
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.fillPoly(mask, [shifted], 255)
+
+        # 👉 output file now includes label
+        out_path = out_dir_path / f"{label}"
+        out_path.mkdir(parents=True, exist_ok=True)
+        out_path = out_path  / f"{base_name}.mp4"
+
+        cmd = [
+            "ffmpeg", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{w}x{h}", "-r", f"{fps:.03f}",
+            "-i", "pipe:0",
+            "-vf", "pad=width=ceil(iw/2)*2:height=ceil(ih/2)*2",
+            "-an", "-c:v", "libx264", "-preset", "veryfast",
+            "-pix_fmt", "yuv420p", str(out_path)
+        ]
+        if threads:
+            cmd[-1:-1] = ["-threads", str(threads)]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        writers.append((proc, w, h))
+        roi_meta.append((label, x0, y0, x1, y1, shifted, mask))
+        outputs.append(str(out_path))
+
+    # write frames
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            for (proc, w, h), meta in zip(writers, roi_meta):
+                _, x0, y0, x1, y1, _, mask = meta
+                crop = frame[y0:y1+1, x0:x1+1].copy()
+                crop[mask==0] = (0,0,0)
+                proc.stdin.write(crop.tobytes())
+    finally:
+        cap.release()
+        codes = []
+        for proc, _, _ in writers:
+            try: proc.stdin.close()
+            except: pass
+            codes.append(proc.wait())
+
+    for out_path, code in zip(outputs, codes):
+        if code != 0:
+            raise RuntimeError(f"ffmpeg failed ({code}) writing {out_path}")
+    return outputs
+
+def run_color_detect(src_path: str, out_dir: str, base: str,
+                     v_low: int = 0, v_high: int = 80, min_frac: float = 0.05,
+                     threads: int = None):
+    """
+    HSV Value threshold detection on one video. Writes
+    <out_dir>/<base>_annotated.mp4 and <out_dir>/<base>_detections.csv
+    (columns: timestamp_sec,roi_name; roi_name is <base>).
+    threads caps the ffmpeg encoder (default: ffmpeg picks, i.e. all cores).
+    Returns {"frames": n, "detections": n, "annotated": path, "csv": path};
+    raises RuntimeError if the encode fails.
+    """
+    cap = cv2.VideoCapture(src_path)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open: {src_path}")
+
+    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps    = cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    roi_name = base
+    out_mp4 = Path(out_dir) / f"{base}_annotated.mp4"
+    out_csv = Path(out_dir) / f"{base}_detections.csv"
+
+    # ffmpeg sink (pad to even size for libx264)
+    cmd = [
+        "ffmpeg", "-loglevel", "error", "-y",
+        "-f", "rawvideo", "-pix_fmt", "bgr24",
+        "-s", f"{width}x{height}", "-r", f"{fps:.03f}",
+        "-i", "pipe:0",
+        "-vf", "pad=width=ceil(iw/2)*2:height=ceil(ih/2)*2",
+        "-an",
+        "-c:v", "libx264", "-preset", "veryfast",
+        "-pix_fmt", "yuv420p",
+        str(out_mp4)
+    ]
+    if threads:
+        cmd[-1:-1] = ["-threads", str(threads)]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    # CSV writer
+    n_hits = 0
+    with open(out_csv, "w", newline="") as fcsv:
+        w = csv.writer(fcsv)
+        w.writerow(["timestamp_sec", "roi_name"])
+
+        frame_idx = 0
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+
+                # HSV threshold (Value in [v_low, v_high])
+                hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+                mask = cv2.inRange(hsv, (0, 0, v_low), (179, 255, v_high))
+                frac = float(cv2.countNonZero(mask)) / (frame.shape[0]*frame.shape[1])
+
+                # annotate if detection
+                if frac >= min_frac:
+                    cv2.circle(frame, (12,12), 8, (0,0,255), -1)  # red dot top-left
+                    ts = frame_idx / fps
+                    w.writerow([f"{ts:.3f}", roi_name])
+                    n_hits += 1
+
+                # write frame
+                proc.stdin.write(frame.tobytes())
+                frame_idx += 1
+        finally:
+            cap.release()
+            try:
+                proc.stdin.close()
+            except Exception:
+                pass
+            code = proc.wait()
+
+    if code != 0:
+        raise RuntimeError(f"ffmpeg failed ({code}) writing {out_mp4}")
+    return {"frames": frame_idx, "detections": n_hits,
+            "annotated": str(out_mp4), "csv": str(out_csv)}
@@ -14,20 +14,19 @@ from datetime import datetime
 from werkzeug.utils import secure_filename
 from flask import Flask, request, jsonify, send_from_directory, abort
 from flask_cors import CORS
+from processing import (BASE_DIR, UPLOAD_DIR, RESULT_DIR, ALLOWED_EXTENSIONS,
+                        is_ffmpeg_available, has_ffmpeg,
+                        run_roi_export, run_color_detect)
 
 # -----------------------
 # Config
 # -----------------------
-BASE_DIR = Path(__file__).resolve().parent
-UPLOAD_DIR = BASE_DIR / "recorded_sessions"
-RESULT_DIR = BASE_DIR / "detection_results"
 DB_PATH = BASE_DIR / "jobs.json"
 
 UPLOAD_DIR.mkdir(exist_ok=True)
 RESULT_DIR.mkdir(exist_ok=True)
 
 MAX_CONTENT_LENGTH = 200 * 1024 * 1024 * 1024  # 200 GB (adjust as needed)
-ALLOWED_EXTENSIONS = {'.webm', '.mp4', '.mkv', '.mov', '.avi', '.ogg'}
 
 # Fake "DLC" generation
 DEFAULT_FPS = 30
@@ -174,16 +173,6 @@ def worker():
 worker_thread = threading.Thread(target=worker, daemon=True)
 worker_thread.start()
 
-def is_ffmpeg_available():
-    try:
-        subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-        return True
-    except Exception:
-        return False
-
-def has_ffmpeg():
-    return is_ffmpeg_available()
-
 import subprocess
 import json
 import shlex
@@ -313,69 +302,14 @@ def export_roi_videos():
     if not rois:
         return jsonify(error="No ROIs provided"), 400
 
-    cap = cv2.VideoCapture(src)
-    if not cap.isOpened():
-        return jsonify(error="Could not open video"), 400
-
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps    = cap.get(cv2.CAP_PROP_FPS) or 30.0
-
-    parent_dir = Path(src).parent
-    out_dir_path = parent_dir / "roi_videos"
-    out_dir_path.mkdir(parents=True, exist_ok=True)
-
-    writers, roi_meta = [], []
-    for i, roi in enumerate(rois, start=1):
-        # sanitize label for filenames
-        label = (roi.get("label") or f"roi{i}").replace(" ", "_")
-        pts = np.array(roi["points"], dtype=np.float32)
-
-        # bounding box
-        x0 = max(0, int(np.floor(pts[:,0].min())) - margin)
-        y0 = max(0, int(np.floor(pts[:,1].min())) - margin)
-        x1 = min(width-1, int(np.ceil(pts[:,0].max())) + margin)
-        y1 = min(height-1, int(np.ceil(pts[:,1].max())) + margin)
-        w, h = max(1, x1-x0+1), max(1, y1-y0+1)
-
-        shifted = (pts - np.array([[x0, y0]], dtype=np.float32)).astype(np.int32).reshape((-1,1,2))
-        mask = np.zeros((h, w), dtype=np.uint8)
-        cv2.fillPoly(mask, [shifted], 255)
-
-        # 👉 output file now includes label
-        out_path = out_dir_path / f"{label}"
-        out_path.mkdir(parents=True, exist_ok=True)
-        out_path = out_path  / f"{base_name}.mp4"
-
-        cmd = [
-            "ffmpeg", "-loglevel", "error", "-y",
-            "-f", "rawvideo", "-pix_fmt", "bgr24",
-            "-s", f"{w}x{h}", "-r", f"{fps:.03f}",
-            "-i", "pipe:0",
-            "-vf", "pad=width=ceil(iw/2)*2:height=ceil(ih/2)*2",
-            "-an", "-c:v", "libx264", "-preset", "veryfast",
-            "-pix_fmt", "yuv420p", str(out_path)
-        ]
-        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
-        writers.append((proc, w, h))
-        roi_meta.append((label, x0, y0, x1, y1, shifted, mask))
-
-    # write frames
+    out_dir_path = Path(src).parent / "roi_videos"
     try:
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                break
-            for (proc, w, h), meta in zip(writers, roi_meta):
-                _, x0, y0, x1, y1, _, mask = meta
-                crop = frame[y0:y1+1, x0:x1+1].copy()
-                crop[mask==0] = (0,0,0)
-                proc.stdin.write(crop.tobytes())
-    finally:
-        cap.release()
-        for proc, _, _ in writers:
-            try: proc.stdin.close(); proc.wait()
-            except: pass
+        run_roi_export(src_path=src, rois=rois, out_dir=str(out_dir_path),
+                       base_name=base_name, margin=margin)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except RuntimeError as e:
+        return jsonify(error=str(e)), 500
 
     return jsonify(status="ok", out_dir=str(out_dir_path))
 
@@ -464,66 +398,14 @@ def detect_color():
         if not os.path.isfile(vid):
             return jsonify(error=f"Missing/video not found: {vid}"), 400
 
-        cap = cv2.VideoCapture(vid)
-        if not cap.isOpened():
-            return jsonify(error=f"Could not open: {vid}"), 400
-
-        width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps    = cap.get(cv2.CAP_PROP_FPS) or 30.0
-        total  = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-
-        base   = Path(vid).stem + f"_{k}"
-        roi_name = base
-        out_mp4 = job_dir / f"{base}_annotated.mp4"
-        out_csv = job_dir / f"{base}_detections.csv"
-
-        # ffmpeg sink (pad to even size for libx264)
-        cmd = [
-            "ffmpeg", "-loglevel", "error", "-y",
-            "-f", "rawvideo", "-pix_fmt", "bgr24",
-            "-s", f"{width}x{height}", "-r", f"{fps:.03f}",
-            "-i", "pipe:0",
-            "-vf", "pad=width=ceil(iw/2)*2:height=ceil(ih/2)*2",
-            "-an",
-            "-c:v", "libx264", "-preset", "veryfast",
-            "-pix_fmt", "yuv420p",
-            str(out_mp4)
-        ]
-        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
-
-        # CSV writer
-        with open(out_csv, "w", newline="") as fcsv:
-            w = csv.writer(fcsv)
-            w.writerow(["timestamp_sec", "roi_name"])
-
-            frame_idx = 0
-            try:
-                while True:
-                    ok, frame = cap.read()
-                    if not ok:
-                        break
-
-                    # HSV threshold (Value in [v_low, v_high])
-                    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-                    mask = cv2.inRange(hsv, (0, 0, v_low), (179, 255, v_high))
-                    frac = float(cv2.countNonZero(mask)) / (frame.shape[0]*frame.shape[1])
-
-                    # annotate if detection
-                    if frac >= min_frac:
-                        cv2.circle(frame, (12,12), 8, (0,0,255), -1)  # red dot top-left
-                        ts = frame_idx / fps
-                        w.writerow([f"{ts:.3f}", roi_name])
-
-                    # write frame
-                    proc.stdin.write(frame.tobytes())
-                    frame_idx += 1
-            finally:
-                cap.release()
-                try:
-                    proc.stdin.close(); proc.wait()
-                except Exception:
-                    pass
+        try:
+            run_color_detect(src_path=vid, out_dir=str(job_dir),
+                             base=Path(vid).stem + f"_{k}",
+                             v_low=v_low, v_high=v_high, min_frac=min_frac)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        except RuntimeError as e:
+            return jsonify(error=str(e)), 500
 
     return jsonify(status="ok", job_id=job_id, out_dir=str(job_dir))
 